@@ -1,14 +1,72 @@
 # -*- coding: utf-8 -*-
+import argparse
+import functools
+import hashlib
 import os
 import sys
+import tempfile
 import time
 import traceback
 import clr
 import io
+import logging
+from concurrent.futures import ProcessPoolExecutor
 
 # Configuração crítica para execução headless
-sys.stdout = io.TextIOWrapper(sys.stdout.buffer, encoding='utf-8')
-sys.stderr = io.TextIOWrapper(sys.stderr.buffer, encoding='utf-8')
+def _utf8(stream, line_buffering):
+    # Evita empilhar wrappers se o módulo for importado/recarregado mais de uma vez
+    if getattr(stream, '_utf8_wrapped', False):
+        return stream
+    wrapper = io.TextIOWrapper(
+        stream.buffer, encoding='utf-8',
+        line_buffering=line_buffering, write_through=False,
+    )
+    wrapper._utf8_wrapped = True
+    return wrapper
+
+# stdout acumula no buffer e é descarregado ao fim de cada fase (_descarregar_saida())
+sys.stdout = _utf8(sys.stdout, line_buffering=False)
+sys.stderr = _utf8(sys.stderr, line_buffering=True)
+
+class _FaseStreamHandler(logging.StreamHandler):
+    """StreamHandler sem flush por mensagem; o stdout é descarregado ao fim de cada fase."""
+    def flush(self):
+        pass
+
+    def descarregar(self):
+        # Flush real, sob o lock do handler (TextIOWrapper não é thread-safe)
+        super().flush()
+
+# Mensagens são formatadas apenas se o nível estiver habilitado;
+# em produção headless use LOG_LEVEL=WARNING (DEBUG=1 mostra também as DLLs)
+DEBUG = os.environ.get("DEBUG", "").strip().lower() in ("1", "true", "yes", "on")
+
+# Valor inválido em LOG_LEVEL não pode derrubar a importação: volta para INFO
+# (aceita nomes como WARNING e níveis numéricos como 30)
+_nivel_log = (os.environ.get("LOG_LEVEL", "").strip() or "INFO").upper()
+if _nivel_log.isdigit():
+    _nivel_log = int(_nivel_log)
+_nivel_valido = isinstance(_nivel_log, int) or isinstance(logging.getLevelName(_nivel_log), int)
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.DEBUG if DEBUG else (_nivel_log if _nivel_valido else logging.INFO))
+
+# Reaproveita o handler já instalado se o módulo for importado/recarregado mais de uma vez,
+# para que _descarregar_saida() use sempre o lock do handler que de fato emite as mensagens
+_saida_handler = next((h for h in logger.handlers if getattr(h, '_fase_handler', False)), None)
+if _saida_handler is None:
+    _saida_handler = _FaseStreamHandler(sys.stdout)
+    _saida_handler._fase_handler = True
+    _saida_handler.setFormatter(logging.Formatter("%(message)s"))
+    logger.addHandler(_saida_handler)
+    logger.propagate = False
+
+if not _nivel_valido:
+    logger.warning("⚠️ LOG_LEVEL inválido (%r); usando INFO.", _nivel_log)
+
+def _descarregar_saida():
+    """Descarrega o stdout do log; seguro para chamar a partir de qualquer thread."""
+    _saida_handler.descarregar()
 
 # -------------------------------------------------------------
 # Configuração de caminhos - ESSENCIAL PARA HEADLESS
@@ -33,36 +91,67 @@ dlls = [
     "System.Buffers.dll",
 ]
 
+# Assemblies já presentes no AppDomain (reexecuções no mesmo interpretador)
+from System import AppDomain
+from System.Reflection import Assembly
+
+_LOADED = {a.GetName().Name for a in AppDomain.CurrentDomain.GetAssemblies()}
+
+# Sidecars que normalmente também existem no GAC: falha aqui não é fatal
+_OPCIONAIS = {"System.Buffers"}
+
 for dll in dlls:
+    nome = os.path.splitext(dll)[0]
+    if nome in _LOADED:
+        continue
     try:
-        clr.AddReference(os.path.join(dwsim_path, dll))
-        print(f"✅ DLL carregada: {dll}")
+        # Caminho fixo e conhecido: carrega direto, sem a sondagem de PATH/sys.path/AppBase
+        Assembly.LoadFrom(os.path.join(dwsim_path, dll))
+        _LOADED.add(nome)
+        logger.debug("✅ DLL carregada: %s", dll)
     except Exception as e:
-        print(f"⚠️ Falha ao carregar {dll}: {str(e)}")
-        # Tenta carregar sem caminho completo (pode funcionar no headless)
+        if nome not in _OPCIONAIS:
+            logger.error("❌ Falha ao carregar %s: %s", dll, e)
+            continue
+        # Tenta pelo nome do assembly (resolução pelo GAC)
         try:
-            clr.AddReference(dll)
-            print(f"✅ DLL carregada (método alternativo): {dll}")
-        except:
-            print(f"❌ Falha crítica ao carregar {dll}")
+            clr.AddReference(nome)
+            _LOADED.add(nome)
+            logger.debug("✅ DLL carregada (GAC): %s", nome)
+        except Exception:
+            logger.warning("⚠️ %s não encontrada em %s nem no GAC: %s", dll, dwsim_path, e)
 
 # Importação ESSENCIAL para execução de scripts
 from DWSIM.Automation import Automation3
 from DWSIM.Interfaces.Enums import Enums
 
+# Valor constante do enum, resolvido uma única vez (evita a cadeia de atributos CLR por objeto)
+PYTHON_SCRIPT_TYPE = Enums.GraphicObjects.ObjectType.PythonScript
+
 # -------------------------------------------------------------
 # Função CRÍTICA para inicialização de blocos Python
 # -------------------------------------------------------------
+def _blocos_python(flowsheet):
+    """Lista dos blocos Python do flowsheet, filtrada em uma única passada."""
+    return [
+        obj for obj in flowsheet.SimulationObjects.Values
+        if obj.GraphicObject.ObjectType == PYTHON_SCRIPT_TYPE
+    ]
+
 def enable_scripting_in_flowsheet(flowsheet):
     """Habilita explicitamente a execução de scripts nos blocos Python"""
-    for obj in flowsheet.SimulationObjects.Values:
-        if obj.GraphicObject.ObjectType == Enums.GraphicObjects.ObjectType.PythonScript:
-            print(f"🔧 Habilitando script em: {obj.Name}")
-            obj.Enabled = True  # Garante que o bloco está habilitado
-            
-            # Configuração especial para execução headless
-            obj.AutomationMode = True  # Modo automação
-            obj.ScriptingInstance = None  # Força recriação do contexto
+    blocos = _blocos_python(flowsheet)
+
+    # Evita ler obj.Name (acesso ao CLR) quando o log INFO está desligado
+    verbose = logger.isEnabledFor(logging.INFO)
+    for obj in blocos:
+        if verbose:
+            logger.info("🔧 Habilitando script em: %s", obj.Name)
+        obj.Enabled = True  # Garante que o bloco está habilitado
+        
+        # Configuração especial para execução headless
+        obj.AutomationMode = True  # Modo automação
+        obj.ScriptingInstance = None  # Força recriação do contexto
 
 # -------------------------------------------------------------
 # Funções existentes modificadas
@@ -74,7 +163,7 @@ def inicializar_flowsheet(caminho):
     gerenciador.InitializeScriptEnvironment = True  # Habilita ambiente de script
     gerenciador.ScriptPaths = []  # Limpa caminhos de script
     
-    print(f"⏳ Carregando flowsheet: {caminho}")
+    logger.info("⏳ Carregando flowsheet: %s", caminho)
     fs = gerenciador.LoadFlowsheet(caminho)
     
     # Habilita explicitamente os blocos Python
@@ -102,15 +191,16 @@ def executar_auto(gerenciador, flowsheet, sufixo):
       - obj = flowsheet.GetFlowsheetSimulationObject(name); obj.Calculated = False: limpa flag de um objeto.
     """
     timeout_seconds = 300  # tempo máximo de cálculo antes de abortar
-    print("⚙️ Iniciando cálculo automático (CalculateFlowsheet3)...")
-    inicio = time.perf_counter()
+    logger.info("⚙️ Iniciando cálculo automático (CalculateFlowsheet3)...")
+    _descarregar_saida()  # Progresso visível durante o cálculo (até timeout_seconds)
+    inicio = time.perf_counter_ns()
     excecoes = gerenciador.CalculateFlowsheet3(flowsheet, timeout_seconds)
-    duracao = time.perf_counter() - inicio
+    duracao_ms = (time.perf_counter_ns() - inicio) // 1_000_000
 
     _relatorio_excecoes(excecoes)
-    print(f"⏱️ Duração cálculo automático: {duracao:.2f}s")
+    logger.info("⏱️ Duração cálculo automático: %dms", duracao_ms)
 
-    _salvar_saida(gerenciador, flowsheet, sufixo, duracao)
+    _salvar_saida(gerenciador, flowsheet, sufixo, duracao_ms)
 
 def executar_ordenado(gerenciador, flowsheet, sufixo):
     """
@@ -134,20 +224,32 @@ def executar_ordenado(gerenciador, flowsheet, sufixo):
       - Edite o XML <CalculationOrderList> diretamente.
       - Ou use flowsheet.RequestCalculation3(None, True) com lista de GUIDs via API.
     """
-    print("⚙️ Iniciando cálculo ordenado (RequestCalculation3)...")
-    inicio = time.perf_counter()
+    logger.info("⚙️ Iniciando cálculo ordenado (RequestCalculation3)...")
+    _descarregar_saida()  # Progresso visível durante o cálculo
+    inicio = time.perf_counter_ns()
     try:
         # sender=None, ChangeCalculationOrder=True
         flowsheet.RequestCalculation3(None, True)
         excecoes = None
     except Exception as e:
         excecoes = [e]
-    duracao = time.perf_counter() - inicio
+    duracao_ms = (time.perf_counter_ns() - inicio) // 1_000_000
 
     _relatorio_excecoes(excecoes)
-    print(f"⏱️ Duração cálculo ordenado: {duracao:.2f}s")
+    logger.info("⏱️ Duração cálculo ordenado: %dms", duracao_ms)
 
-    _salvar_saida(gerenciador, flowsheet, sufixo, duracao)
+    _salvar_saida(gerenciador, flowsheet, sufixo, duracao_ms)
+
+@functools.lru_cache(maxsize=None)
+def _formatter_for(tipo):
+    """
+    Returns the message formatter for an exception type: .NET exceptions use ToString(),
+    Python exceptions fall back to str(). Cached per type, so the attribute lookup on
+    the CLR side happens once per exception class.
+    """
+    if hasattr(tipo, 'ToString'):
+        return lambda ex: ex.ToString()
+    return str
 
 def _relatorio_excecoes(excecoes):
     """
@@ -158,12 +260,12 @@ def _relatorio_excecoes(excecoes):
     """
     if excecoes:
         for ex in excecoes:
-            msg = ex.ToString() if hasattr(ex, 'ToString') else str(ex)
-            print(f"⚠️ Exceção: {msg}")
+            msg = _formatter_for(type(ex))(ex)
+            logger.warning("⚠️ Exceção: %s", msg)
     else:
-        print("🚀 Sem exceções durante o cálculo.")
+        logger.info("🚀 Sem exceções durante o cálculo.")
 
-def _salvar_saida(gerenciador, flowsheet, sufixo, duracao):
+def _salvar_saida(gerenciador, flowsheet, sufixo, duracao_ms):
     """
     Saves the calculated flowsheet and a log file with execution details.
 
@@ -171,50 +273,180 @@ def _salvar_saida(gerenciador, flowsheet, sufixo, duracao):
         gerenciador (Automation3): Instance of the DWSIM automation manager.
         flowsheet (IFlowsheet): The flowsheet object to be saved.
         sufixo (str): Suffix to differentiate output and log files.
-        duracao (float): Duration of the calculation in seconds.
+        duracao_ms (int): Duration of the calculation in milliseconds.
     """
     base, ext = os.path.splitext(flowsheet_path)
     arquivo_saida = f"{base}_{sufixo}{ext}"
     arquivo_log = f"{base}_{sufixo}_log.txt"
 
-    print(f"💾 Salvando flowsheet: {arquivo_saida}")
-    gerenciador.SaveFlowsheet(flowsheet, arquivo_saida, compressed=False)
+    logger.info("💾 Salvando flowsheet: %s", arquivo_saida)
+    gerenciador.SaveFlowsheet(flowsheet, arquivo_saida, compressed=True)
 
-    with open(arquivo_log, 'w', encoding='utf-8') as log:
-        log.write(f"Entrada: {flowsheet_path}\n")
-        log.write(f"Saída:   {arquivo_saida}\n")
-        log.write(f"Duração: {duracao:.2f}s\n")
+    with open(arquivo_log, 'w', encoding='utf-8', buffering=8192) as log:
+        log.write(
+            f"Entrada: {flowsheet_path}\n"
+            f"Saída:   {arquivo_saida}\n"
+            f"Duração: {duracao_ms}ms\n"
+        )
 
-    print(f"📂 Flowsheet gerado: {arquivo_saida}")
-    print(f"📄 Log gerado: {arquivo_log}\n")
+    logger.info("📂 Flowsheet gerado: %s\n📄 Log gerado: %s\n", arquivo_saida, arquivo_log)
+    _descarregar_saida()
 
 
 # ... (mantenha as outras funções como executar_auto, executar_ordenado, etc) ...
 
-def main():
-    # Execução automática incremental
-    mgr_auto, fs_auto = inicializar_flowsheet(flowsheet_path)
-    
-    # Força cálculo inicial para estabilizar
-    print("⚙️ Executando cálculo inicial de estabilização...")
-    fs_auto.RequestCalculation2(True, True)  # Força recálculo completo
-    
-    executar_auto(mgr_auto, fs_auto, sufixo='auto')
+def _cache_estavel(caminho):
+    """
+    Diretório de cache e nome do flowsheet estabilizado, indexado pelo hash do conteúdo
+    de entrada: <dir>/.dwsim_cache/<nome>_<hash>.stable<ext>.
+    """
+    with open(caminho, 'rb') as f:
+        chave = hashlib.blake2b(f.read(), digest_size=16).hexdigest()
+    pasta, arquivo = os.path.split(caminho)
+    nome, ext = os.path.splitext(arquivo)
+    return os.path.join(pasta, ".dwsim_cache"), f"{nome}_{chave}.stable{ext}"
 
-    # Execução ordenada baseada no XML
-    mgr_ord, fs_ord = inicializar_flowsheet(flowsheet_path)
-    
-    # Força cálculo inicial para estabilização
-    print("⚙️ Executando cálculo inicial de estabilização...")
-    fs_ord.RequestCalculation2(True, True)
-    
-    executar_ordenado(mgr_ord, fs_ord, sufixo='ordenado')
+def _limpar_cache_estavel(pasta_cache, arquivo_atual):
+    """Remove versões antigas (hash diferente) do flowsheet estabilizado da mesma entrada."""
+    sufixo = ".stable" + os.path.splitext(arquivo_atual)[1]
+    nome = arquivo_atual[:-len(sufixo)].rpartition('_')[0]
+    for arquivo in os.listdir(pasta_cache):
+        if arquivo == arquivo_atual or not arquivo.endswith(sufixo):
+            continue
+        prefixo, _, chave = arquivo[:-len(sufixo)].rpartition('_')
+        if prefixo == nome and len(chave) == 32:
+            logger.info("🧹 Removendo cache antigo: %s", arquivo)
+            os.remove(os.path.join(pasta_cache, arquivo))
+
+def resolver_cache_estavel(caminho):
+    """
+    Retorna o caminho do flowsheet já estabilizado (recálculo completo), reaproveitando
+    o resultado gravado em disco quando o arquivo de entrada não mudou:
+      - Cache hit: retorna .dwsim_cache/<nome>_<hash>.stable.dwxmz sem recalcular.
+      - Cache miss: carrega o original, força recálculo completo (RequestCalculation2)
+        e grava o resultado no cache antes de retornar o caminho.
+    As execuções carregam sempre esse arquivo, de modo que hit e miss partem do mesmo estado.
+    A gravação usa um arquivo temporário na mesma pasta + os.replace, de modo que uma
+    interrupção no meio do SaveFlowsheet nunca deixa um cache truncado.
+    """
+    pasta_cache, arquivo_estavel = _cache_estavel(caminho)
+    caminho_estavel = os.path.join(pasta_cache, arquivo_estavel)
+    if os.path.exists(caminho_estavel):
+        logger.info("♻️ Usando flowsheet estabilizado em cache: %s", caminho_estavel)
+        return caminho_estavel
+
+    gerenciador, fs = inicializar_flowsheet(caminho)
+
+    logger.info("⚙️ Executando cálculo inicial de estabilização...")
+    fs.RequestCalculation2(True, True)  # Força recálculo completo
+
+    os.makedirs(pasta_cache, exist_ok=True)
+    nome, ext = os.path.splitext(arquivo_estavel)
+    fd, temporario = tempfile.mkstemp(prefix=f"{nome}.", suffix=f".tmp{ext}", dir=pasta_cache)
+    os.close(fd)
+    try:
+        gerenciador.SaveFlowsheet(fs, temporario, compressed=True)
+        os.replace(temporario, caminho_estavel)
+    except BaseException:
+        if os.path.exists(temporario):
+            os.remove(temporario)
+        raise
+    logger.info("💾 Flowsheet estabilizado salvo em cache: %s", caminho_estavel)
+
+    _limpar_cache_estavel(pasta_cache, arquivo_estavel)
+
+    return caminho_estavel
+
+def _preparar_recalculo(flowsheet, force_full):
+    """
+    Por padrão mantém as flags `Calculated` gravadas no arquivo, para que os métodos
+    incrementais recalculem apenas os blocos "dirty". Com --force-full, limpa todas
+    as flags e o cálculo seguinte percorre o flowsheet inteiro.
+    """
+    if force_full:
+        logger.info("⚙️ Limpando flags de cálculo (--force-full)...")
+        flowsheet.ClearAllCalculatedFlags()
+
+def _executar(sufixo, caminho, force_full):
+    """Carrega o flowsheet em um Automation3 próprio, prepara as flags e executa o cálculo."""
+    executar = {'auto': executar_auto, 'ordenado': executar_ordenado}[sufixo]
+    gerenciador, fs = inicializar_flowsheet(caminho)
+    _preparar_recalculo(fs, force_full)
+    executar(gerenciador, fs, sufixo)
+
+def _executar_em_processo(sufixo, caminho, force_full):
+    """
+    Ponto de entrada de --paralelo: cada cálculo roda em um processo próprio, com CLR e
+    GlobalSettings.Settings (estado do solver, TaskCancellationTokenSource) isolados.
+    """
+    try:
+        _executar(sufixo, caminho, force_full)
+    except Exception:
+        # Exceções .NET não são serializáveis entre processos; envia o traceback como texto
+        raise RuntimeError(traceback.format_exc()) from None
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Executa o flowsheet DWSIM em modo headless.")
+    modo = parser.add_mutually_exclusive_group()
+    modo.add_argument(
+        "--force-full", action="store_true",
+        help="limpa as flags Calculated antes do cálculo, forçando recálculo completo",
+    )
+    modo.add_argument(
+        "--cache-estavel", action="store_true",
+        help="parte de um flowsheet estabilizado por recálculo completo, "
+             "em cache pelo hash do arquivo de entrada (.dwsim_cache/)",
+    )
+    parser.add_argument(
+        "--paralelo", action="store_true",
+        help="executa os dois cálculos ao mesmo tempo, um processo por cálculo "
+             "(as durações registradas deixam de ser comparáveis)",
+    )
+    args = parser.parse_args(argv)
+
+    # O cache é resolvido (ou construído) uma única vez; as duas execuções carregam o
+    # mesmo arquivo, para que ambas partam exatamente do mesmo estado.
+    caminho = resolver_cache_estavel(flowsheet_path) if args.cache_estavel else flowsheet_path
+
+    # Execução automática incremental e execução ordenada baseada no XML
+    sufixos = ['auto', 'ordenado']
+
+    # Padrão: execuções sequenciais, para que as durações de CalculateFlowsheet3 e
+    # RequestCalculation3 sejam medidas sem concorrência.
+    if not args.paralelo:
+        for sufixo in sufixos:
+            _executar(sufixo, caminho, args.force_full)
+        return
+
+    # Um processo por cálculo: o estado estático do DWSIM não é compartilhado entre as
+    # execuções, mas elas ainda competem por CPU.
+    logger.warning(
+        "⚠️ --paralelo: os cálculos competem por CPU; as durações registradas não são comparáveis."
+    )
+    _descarregar_saida()
+    with ProcessPoolExecutor(max_workers=2) as executor:
+        futuros = [
+            executor.submit(_executar_em_processo, sufixo, caminho, args.force_full)
+            for sufixo in sufixos
+        ]
+
+    excecoes = []
+    for futuro in futuros:
+        try:
+            futuro.result()
+        except Exception as e:
+            excecoes.append(e)
+
+    if excecoes:
+        _relatorio_excecoes(excecoes)
+        raise excecoes[0]
 
 if __name__ == '__main__':
     try:
         main()
     except Exception as e:
-        print("❌ Erro inesperado:")
+        logger.error("❌ Erro inesperado:")
+        _descarregar_saida()
         traceback.print_exc()
         
         # Log detalhado para diagnóstico